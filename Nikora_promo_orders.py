@@ -24,16 +24,18 @@ Extra rule (export):
 - NEW: Move first column to last position before export.
 
 Run:
-    pip install streamlit pandas openpyxl XlsxWriter
+    pip install streamlit pandas pyarrow openpyxl XlsxWriter python-calamine
     python -m streamlit run Nikora_promo_orders.py
 """
 
 import io
 import os
+import tempfile
 import zipfile
 from datetime import datetime
 from typing import Dict, List
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
@@ -42,6 +44,7 @@ import streamlit as st
 # ----------------------------
 
 DATE_STR_FMT = "%Y-%m-%d"
+STR_DTYPE = "string[pyarrow]"  # Arrow-backed strings: C++ kernels for strip/upper/hash
 WEEKDAYS_EN: List[str] = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday"]
 
 # Locked column names
@@ -70,57 +73,110 @@ GEORGIAN_DAY = {
     "Friday": "პარასკევი",
 }
 
+# Download order of split files
+ORDERED_WD: List[str] = WEEKDAYS_EN + ["Unassigned"]
+
+# Schedule weekday lookup: "1".."5" (leading zeros stripped first), English (any case), Georgian (no case) -> English
+WD_MAP: Dict[str, str] = {str(i): wd for i, wd in enumerate(WEEKDAYS_EN, start=1)}
+WD_MAP.update({wd.lower(): wd for wd in WEEKDAYS_EN})
+WD_MAP.update({geo: wd for wd, geo in GEORGIAN_DAY.items()})
+
 # ----------------------------
 # Helpers
 # ----------------------------
 
+def _read_excel_first_sheet(src) -> pd.DataFrame:
+    """Read only the first sheet; prefer calamine, else pandas' default engine."""
+    if isinstance(src, bytes):
+        src = io.BytesIO(src)
+    try:
+        return pd.read_excel(src, sheet_name=0, engine="calamine")
+    except ImportError:
+        pass  # python-calamine not installed
+    except ValueError as exc:
+        if "calamine" not in str(exc):
+            raise
+        # pandas < 2.2: "Unknown engine: calamine"
+    if isinstance(src, io.BytesIO):
+        src.seek(0)
+    # openpyxl (already read-only in pandas) for .xlsx, xlrd for .xls
+    return pd.read_excel(src, sheet_name=0)
+
+@st.cache_data(show_spinner=False, max_entries=8)  # order + overrides of recent runs; uploads can be large
+def _read_table_bytes(name: str, data: bytes) -> pd.DataFrame:
+    """Parse uploaded bytes as CSV or Excel (cached by file name + content)."""
+    name = name.lower()
+    if name.endswith(".csv"):
+        return pd.read_csv(io.BytesIO(data))
+    if name.endswith((".xls", ".xlsx")):
+        return _read_excel_first_sheet(data)
+    return pd.DataFrame()
+
 def read_any_table(uploaded_file) -> pd.DataFrame:
     """Read CSV or Excel into DataFrame (first sheet if multiple)."""
     if uploaded_file is None:
         return pd.DataFrame()
-    name = uploaded_file.name.lower()
-    if name.endswith(".csv"):
-        return pd.read_csv(uploaded_file)
-    if name.endswith((".xls", ".xlsx")):
-        obj = pd.read_excel(uploaded_file, sheet_name=None)
-        first = next(iter(obj))
-        return obj[first].copy()
-    return pd.DataFrame()
+    return _read_table_bytes(uploaded_file.name, uploaded_file.getvalue())
 
-def read_path_first_sheet(path: str) -> pd.DataFrame:
-    """Read Excel path (first sheet). Return empty df if missing."""
+@st.cache_data(show_spinner=False)
+def read_path_first_sheet(path: str, mtime: float = 0.0) -> pd.DataFrame:
+    """Read Excel path (first sheet). Return empty df if missing.
+
+    `mtime` is only part of the cache key, so edits to the file invalidate it.
+    """
     if not os.path.exists(path):
         return pd.DataFrame()
-    obj = pd.read_excel(path, sheet_name=None)
-    first = next(iter(obj))
-    return obj[first].copy()
-
-def normalize_weekday(val) -> str:
-    """Return English weekday name Monday..Friday, or '' if invalid."""
-    if pd.isna(val):
-        return ""
-    s = str(val).strip()
-    if s.isdigit():
-        i = int(s)
-        if 1 <= i <= 5:
-            return WEEKDAYS_EN[i-1]
-        return ""
-    low = s.lower()
-    eng_map = {"monday":"Monday","tuesday":"Tuesday","wednesday":"Wednesday","thursday":"Thursday","friday":"Friday"}
-    if low in eng_map:
-        return eng_map[low]
-    geo_map = {"ორშაბათი":"Monday","სამშაბათი":"Tuesday","ოთხშაბათი":"Wednesday","ხუთშაბათი":"Thursday","პარასკევი":"Friday"}
-    if s in geo_map:
-        return geo_map[s]
-    return ""
-
+    return _read_excel_first_sheet(path)
+
+def normalize_weekday(values: pd.Series) -> pd.Series:
+    """Return English weekday names Monday..Friday, or '' if invalid."""
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        # Numeric column (1..5): index the weekday list directly, no string round-trip
+        codes = values.to_numpy(dtype=float, na_value=np.nan)
+        ok = (codes >= 1) & (codes <= len(WEEKDAYS_EN)) & (codes == np.floor(codes))
+        out = np.full(len(codes), "", dtype=object)
+        out[ok] = np.asarray(WEEKDAYS_EN, dtype=object)[codes[ok].astype(int) - 1]
+        return pd.Series(out, index=values.index)
+    s = values.astype(str).str.strip()
+    s = s.str.replace(r"^0+(?=\d)", "", regex=True)  # digit strings: "03" -> "3", as int() did
+    return s.str.lower().map(WD_MAP).fillna("")
+
+@st.cache_data(show_spinner=False)
+def prepare_schedule(df: pd.DataFrame) -> pd.DataFrame:
+    """Normalize schedule to unique (shop, weekday) rows; first row per shop wins."""
+    out = df.copy()
+    out[SCHED_SHOP_COL] = out[SCHED_SHOP_COL].astype(STR_DTYPE).str.strip().str.upper()
+    out["__Weekday__"] = normalize_weekday(out[SCHED_DAY_COL])
+    return out[[SCHED_SHOP_COL, "__Weekday__"]].drop_duplicates(SCHED_SHOP_COL)
+
+@st.cache_data(show_spinner=False)
+def prepare_mapping(df: pd.DataFrame) -> pd.Series:
+    """Build old -> new barcode Series from the Georgian mapping columns (last row wins)."""
+    old = df[MAP_OLD_COL_GEO].astype(STR_DTYPE)
+    new = df[MAP_NEW_COL_GEO].astype(STR_DTYPE)
+    mapping = pd.Series(new.array, index=pd.Index(old.array))
+    return mapping[~mapping.index.duplicated(keep="last")]
+
+def _df_content_hash(df: pd.DataFrame) -> bytes:
+    """Full-content hash (Streamlit's default samples rows of large frames)."""
+    return str(list(df.columns)).encode() + pd.util.hash_pandas_object(df, index=True).values.tobytes()
+
+@st.cache_data(show_spinner=False, max_entries=12, hash_funcs={pd.DataFrame: _df_content_hash})
 def export_excel_bytes(df: pd.DataFrame, sheet_name: str = "Orders") -> bytes:
+    """Serialize df to xlsx; memoized on content (about two runs of six files)."""
     bio = io.BytesIO()
-    with pd.ExcelWriter(bio, engine="xlsxwriter") as writer:
+    # No "constant_memory": to_excel writes column by column, which that mode would silently truncate
+    with pd.ExcelWriter(bio, engine="xlsxwriter", engine_kwargs={"options": {"strings_to_urls": False}}) as writer:
         df.to_excel(writer, index=False, sheet_name=sheet_name)
     bio.seek(0)
     return bio.read()
 
+def fname_for(wd: str, date_str: str) -> str:
+    """Export file name for a weekday split (or 'Unassigned')."""
+    if wd == "Unassigned":
+        return f"ნიკორა, გაურკვეველი დღე, {date_str}.xlsx"
+    return f"ნიკორა, {GEORGIAN_DAY.get(wd, wd)}, {date_str}.xlsx"
+
 def try_load_local(filename_candidates: List[str]) -> pd.DataFrame:
     """Try load first existing path relative to script dir; else empty df."""
     here = os.path.dirname(__file__)
@@ -130,7 +186,7 @@ def try_load_local(filename_candidates: List[str]) -> pd.DataFrame:
         for p in (p1, p2):
             try:
                 if os.path.exists(p):
-                    return read_path_first_sheet(p)
+                    return read_path_first_sheet(p, os.path.getmtime(p))
             except Exception:
                 continue
     return pd.DataFrame()
@@ -170,33 +226,38 @@ with left:
     else:
         st.success("Loaded local barcode map ✔")
 
-    st.subheader("1) Upload Order file (REQUIRED)")
-    order_file = st.file_uploader("Order file (.xlsx / .xls / .csv)", type=["xlsx","xls","csv"], key="order")
-
-    st.caption("Optional: override local files at runtime (if needed)")
-    override_schedule = st.file_uploader("Override Shop Schedule (optional)", type=["xlsx","xls","csv"], key="sched_override")
-    override_map      = st.file_uploader("Override Barcode Map (optional)", type=["xlsx","xls","csv"], key="map_override")
-
-    # Apply overrides if provided
-    if override_schedule is not None:
-        schedule_df = read_any_table(override_schedule)
-        st.warning("Using OVERRIDE Shop Schedule (uploaded file).")
-    if override_map is not None:
-        map_df = read_any_table(override_map)
-        st.warning("Using OVERRIDE Barcode Map (uploaded file).")
+    # Inputs live in a form: widget changes don't rerun processing until "Run" is submitted
+    with st.form("run"):
+        st.subheader("1) Upload Order file (REQUIRED)")
+        order_file = st.file_uploader("Order file (.xlsx / .xls / .csv)", type=["xlsx","xls","csv"], key="order")
 
-    # Proceed
-    if order_file is not None and not schedule_df.empty and not map_df.empty:
-        df = read_any_table(order_file)
+        st.caption("Optional: override local files at runtime (if needed)")
+        override_schedule = st.file_uploader("Override Shop Schedule (optional)", type=["xlsx","xls","csv"], key="sched_override")
+        override_map      = st.file_uploader("Override Barcode Map (optional)", type=["xlsx","xls","csv"], key="map_override")
 
         st.subheader("2) Process with fixed columns")
         st.write(f"- Order barcode column: **{ORDER_BARCODE_COL}**")
         st.write(f"- Order shop column: **{ORDER_SHOP_COL}**")
         st.write(f"- Schedule shop column: **{SCHED_SHOP_COL}**")
         st.write(f"- Schedule weekday column: **{SCHED_DAY_COL}**")
-        go = st.button("Run (Barcode fix → Weekday split)")
+        go = st.form_submit_button("Run (Barcode fix → Weekday split)")
+
+    if go:
+        # Apply overrides if provided
+        if override_schedule is not None:
+            schedule_df = read_any_table(override_schedule)
+            st.warning("Using OVERRIDE Shop Schedule (uploaded file).")
+        if override_map is not None:
+            map_df = read_any_table(override_map)
+            st.warning("Using OVERRIDE Barcode Map (uploaded file).")
+
+        if order_file is None:
+            st.error("Upload an Order file first.")
+        elif schedule_df.empty or map_df.empty:
+            st.error("Shop schedule or barcode map is empty — cannot run.")
+        else:
+            df = read_any_table(order_file)
 
-        if go:
             # Validate required columns exist
             missing = []
             for c in (ORDER_BARCODE_COL, ORDER_SHOP_COL):
@@ -214,36 +275,47 @@ with left:
                 st.stop()
 
             # Step 1: Barcode fix (no deletions)
-            work = df.copy()
-            mapping = dict(zip(map_df[MAP_OLD_COL_GEO].astype(str), map_df[MAP_NEW_COL_GEO].astype(str)))
-            work[ORDER_BARCODE_COL] = work[ORDER_BARCODE_COL].astype(str).map(lambda x: mapping.get(x, x))
+            work = df  # no copy: st.cache_data hands back a fresh frame on every read
+            mapping = prepare_mapping(map_df)
+            s = work[ORDER_BARCODE_COL].astype(STR_DTYPE)
+            # The fix list is small: only look up rows whose barcode is actually on it
+            mask = s.isin(mapping.index)
+            if mask.any():
+                old = s[mask]
+                s[mask] = old.map(mapping).fillna(old)
+            work[ORDER_BARCODE_COL] = s
 
             # Step 2: VLOOKUP weekday
-            work[ORDER_SHOP_COL] = work[ORDER_SHOP_COL].astype(str).str.strip().str.upper()
-            schedule_df[SCHED_SHOP_COL] = schedule_df[SCHED_SHOP_COL].astype(str).str.strip().str.upper()
-            schedule_df["__Weekday__"] = schedule_df[SCHED_DAY_COL].apply(normalize_weekday)
-
-            merged = work.merge(
-                schedule_df[[SCHED_SHOP_COL, "__Weekday__"]],
-                left_on=ORDER_SHOP_COL,
-                right_on=SCHED_SHOP_COL,
-                how="left",
+            work[ORDER_SHOP_COL] = work[ORDER_SHOP_COL].astype(STR_DTYPE).str.strip().str.upper()
+            schedule = prepare_schedule(schedule_df)
+
+            # Shared categories make the lookup hash integer codes instead of strings
+            # (missing shops stay <NA>; categories themselves must be non-null)
+            shop_dtype = pd.CategoricalDtype(pd.concat([work[ORDER_SHOP_COL], schedule[SCHED_SHOP_COL]]).dropna().unique())
+            work[ORDER_SHOP_COL] = work[ORDER_SHOP_COL].astype(shop_dtype)
+            schedule[SCHED_SHOP_COL] = schedule[SCHED_SHOP_COL].astype(shop_dtype)
+
+            # One weekday per shop, looked up without a join
+            sched_map = schedule.set_index(SCHED_SHOP_COL)["__Weekday__"]
+            # (astype: mapping a categorical can itself return a categorical, which rejects fillna(""));
+            # positional Categorical so grouping skips index alignment and unknowns are one code compare
+            weekday = pd.Categorical(
+                work[ORDER_SHOP_COL].map(sched_map).astype(object).fillna("").to_numpy(),
+                categories=WEEKDAYS_EN + [""],
             )
+            unknown_mask = weekday.codes == len(WEEKDAYS_EN)
 
-            # Split and remove extra columns (incl. "Дата документа", "მაღაზიის მისამართი")
-            cols_to_remove = ["__Weekday__", SCHED_SHOP_COL] + EXPORT_DROP_COLS
+            # Export layout once (drop "Дата документа", "მაღაზიის მისამართი"; first column last), then split in one pass
+            work = work.drop(columns=EXPORT_DROP_COLS, errors="ignore")
+            work = move_first_col_to_last(work)  # NEW CHANGE
+            groups = dict(tuple(work.groupby(weekday, sort=False, observed=True)))
             splits: Dict[str, pd.DataFrame] = {}
             for wd in WEEKDAYS_EN:
-                part = merged[merged["__Weekday__"] == wd].drop(columns=cols_to_remove, errors="ignore")
-                part = move_first_col_to_last(part)  # NEW CHANGE
-                splits[wd] = part
+                splits[wd] = groups.get(wd, work.iloc[0:0])
 
             # Unassigned
-            unknown_mask = merged["__Weekday__"].isna() | (merged["__Weekday__"] == "")
-            if unknown_mask.sum() > 0:
-                part = merged[unknown_mask].drop(columns=cols_to_remove, errors="ignore")
-                part = move_first_col_to_last(part)  # NEW CHANGE
-                splits["Unassigned"] = part
+            if unknown_mask.any():
+                splits["Unassigned"] = groups[""]
                 st.warning(f"{int(unknown_mask.sum())} rows have no weekday in schedule — kept in 'Unassigned'.")
 
             # Summary
@@ -253,31 +325,30 @@ with left:
             # Downloads
             st.subheader("Download files")
             date_str = datetime.now().strftime(DATE_STR_FMT)
-            for wd in ["Monday","Tuesday","Wednesday","Thursday","Friday","Unassigned"]:
-                if wd in splits:
-                    geo = GEORGIAN_DAY.get(wd, wd)
-                    fname = f"ნიკორა, {geo}, {date_str}.xlsx" if wd != "Unassigned" else f"ნიკორა, გაურკვეველი დღე, {date_str}.xlsx"
-                    data = export_excel_bytes(splits[wd])
-                    st.download_button(
-                        label=f"Download {wd} ({geo})",
-                        data=data,
-                        file_name=fname,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    )
+            # Empty weekdays (common for short promos) get no file
+            exports = {wd: export_excel_bytes(splits[wd]) for wd in ORDERED_WD if wd in splits and len(splits[wd])}
+            entries = [(wd, GEORGIAN_DAY.get(wd, wd), fname_for(wd, date_str), data) for wd, data in exports.items()]
+            for wd, geo, fname, data in entries:
+                st.download_button(
+                    label=f"Download {wd} ({geo})",
+                    data=data,
+                    file_name=fname,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                )
 
             # ZIP
             st.subheader("Or download everything as ZIP")
-            zip_bio = io.BytesIO()
-            with zipfile.ZipFile(zip_bio, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-                for wd in ["Monday","Tuesday","Wednesday","Thursday","Friday","Unassigned"]:
-                    if wd in splits:
-                        geo = GEORGIAN_DAY.get(wd, wd)
-                        fname = f"ნიკორა, {geo}, {date_str}.xlsx" if wd != "Unassigned" else f"ნიკორა, გაურკვეველი დღე, {date_str}.xlsx"
-                        zf.writestr(fname, export_excel_bytes(splits[wd]))
+            # .xlsx is already deflated; store as-is, spilling to disk past 64 MB
+            zip_bio = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+            with zipfile.ZipFile(zip_bio, "w", compression=zipfile.ZIP_STORED) as zf:
+                for _, _, fname, data in entries:
+                    zf.writestr(fname, data)
             zip_bio.seek(0)
+            zip_data = zip_bio.read()
+            zip_bio.close()
             st.download_button(
                 label="Download ZIP (all files)",
-                data=zip_bio.getvalue(),
+                data=zip_data,
                 file_name=f"ნიკორა, დაგრუპული დღეებით, {date_str}.zip",
                 mime="application/zip",
             )